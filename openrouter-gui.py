@@ -4,15 +4,19 @@ import json
 import base64
 import mimetypes
 import re
+import stat
+import time
+import atexit
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Optional, Dict, Any
 from pathlib import Path
+from urllib.parse import quote
 
 import requests
 import keyring
-import markdown
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, TextLexer
-from pygments.formatters import HtmlFormatter
+# markdown・pygmentsは読み込みに時間がかかるため、最初に描画するときに読み込む
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QTextEdit, QLineEdit, QPushButton, QScrollArea, QLabel, 
@@ -21,14 +25,34 @@ from PyQt6.QtWidgets import (
     QListWidget, QListWidgetItem, QMenu, QToolButton, QTextBrowser
 )
 from PyQt6.QtCore import (
-    Qt, QThread, pyqtSignal, QMimeData, QUrl, pyqtSlot,
-    QPropertyAnimation, QEasingCurve, QRect, QTimer
+    Qt, pyqtSignal, QMimeData, QUrl, pyqtSlot,
+    QPropertyAnimation, QEasingCurve, QRect, QTimer,
+    QObject, QRunnable, QThreadPool, QSignalBlocker
 )
 from PyQt6.QtGui import (
     QFont, QPixmap, QDragEnterEvent, QDropEvent, QAction,
-    QIcon, QPalette, QColor, QLinearGradient, QPainter
+    QIcon, QPalette, QColor, QLinearGradient, QPainter, QImage, QImageReader,
+    QStandardItem, QPixmapCache, QTextCursor, QTextBlockFormat, QTextCharFormat
 )
 
+# SIMD対応のpybase64があれば使用（なければ標準のbase64）
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+# 高速なorjsonがあれば使用（なければ標準のjson）
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+    
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
 # 設定ファイルのパス（APIキー以外の設定用）
 CONFIG_FILE = "openrouter_config.json"
 # keyringサービス名
@@ -36,56 +60,163 @@ KEYRING_SERVICE = "OpenRouter-GUI"
 KEYRING_USERNAME = "api_key"
 # モデル情報キャッシュファイル
 MODEL_CACHE_FILE = "model_cache.json"
+# モデル一覧の再取得間隔（秒）。この間は一覧にないモデルのために再取得しない
+MODEL_LIST_TTL = 3600
+# Base64エンコード時の読み込みサイズ（3の倍数）
+BASE64_CHUNK_SIZE = 3 * 1024 * 1024
+# これより大きい画像はアップロード先が設定されていればURLで送信
+UPLOAD_THRESHOLD = 1_000_000
+# APIに送信する会話履歴の最大メッセージ数（画面上の履歴はすべて保持）
+MAX_HISTORY_MESSAGES = 20
+
+# HTTP通信用の共有セッション（TLS接続をリクエスト間で再利用）
+# 認証ヘッダーはアップロード先に送らないよう、リクエストごとに指定する
+_HTTP = requests.Session()
+
+# 設定ファイルの内容（初回読み込み後はメモリ上で保持）
+_CONFIG_CACHE = None
+
+def _read_config() -> Dict:
+    """設定ファイルを読み込み（2回目以降はキャッシュを返す）"""
+    global _CONFIG_CACHE
+    if _CONFIG_CACHE is None:
+        try:
+            # ファイル全体を1回のreadで読み込んでからパースする
+            with open(CONFIG_FILE, 'rb') as f:
+                _CONFIG_CACHE = _json_loads(f.read())
+        except FileNotFoundError:
+            _CONFIG_CACHE = {}
+    return _CONFIG_CACHE
+
+def _write_config(config: Dict):
+    """設定をキャッシュに反映してファイルに保存（APIキーは含めない）"""
+    global _CONFIG_CACHE
+    _CONFIG_CACHE = config
+    # 一時ファイルに書いてから置き換え、書き込み途中で壊れた設定ファイルが残らないようにする
+    tmp_path = CONFIG_FILE + ".tmp"
+    # 全体を一度にエンコードし、1回のwriteで書き込む
+    payload = json.dumps(config, ensure_ascii=False, indent=2).encode('utf-8')
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        # 置き換え前に内容をディスクへ確定させ、電源断などでも空ファイルにならないようにする
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CONFIG_FILE)
+
+# keyringに保存されたAPIキー（初回取得後はメモリ上で保持）
+_API_KEY_CACHE = None
+
+def _get_api_key() -> str:
+    """APIキーをkeyringから取得（2回目以降はキャッシュを返す）"""
+    global _API_KEY_CACHE
+    if _API_KEY_CACHE is None:
+        _API_KEY_CACHE = keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME) or ''
+    return _API_KEY_CACHE
+
+def _set_api_key(api_key: str):
+    """APIキーをkeyringに保存してキャッシュを更新（空の場合は削除）"""
+    global _API_KEY_CACHE
+    if api_key:
+        keyring.set_password(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
+    else:
+        try:
+            keyring.delete_password(KEYRING_SERVICE, KEYRING_USERNAME)
+        except keyring.errors.PasswordDeleteError:
+            pass
+    _API_KEY_CACHE = api_key
+
+# 保存された選択がない場合に選ぶモデル
+DEFAULT_MODEL = "openai/gpt-4o"
+
+# 組み込みモデル一覧（カテゴリ → (モデルID, 表示名)）
+MODEL_CATALOG = {
+    "🔥 おすすめ (Vision対応)": [
+        ("openai/gpt-4o", "GPT-4o - 最新、画像・文書解析"),
+        ("anthropic/claude-3.5-sonnet", "Claude 3.5 Sonnet - 高性能、推論力"),
+        ("google/gemini-pro-1.5", "Gemini Pro 1.5 - 大容量コンテキスト")
+    ],
+    "💰 コスパ重視": [
+        ("openai/gpt-4o-mini", "GPT-4o Mini - 高品質、低価格"),
+        ("anthropic/claude-3-haiku", "Claude 3 Haiku - 高速、軽量"),
+        ("google/gemini-flash-1.5", "Gemini Flash 1.5 - 高速処理")
+    ],
+    "🆓 無料モデル": [
+        ("qwen/qwen-2-vl-72b-instruct", "Qwen2-VL 72B - 無料画像解析"),
+        ("microsoft/phi-3.5-vision-instruct", "Phi-3.5 Vision - 小型高性能"),
+        ("meta-llama/llama-3.1-8b-instruct", "Llama 3.1 8B - 軽量無料")
+    ],
+    "🎨 画像特化": [
+        ("openai/gpt-4-vision-preview", "GPT-4 Vision - 画像理解"),
+        ("mistralai/pixtral-12b", "Pixtral 12B - 画像生成"),
+        ("meta-llama/llama-3.2-90b-vision-instruct", "Llama 3.2 Vision - 大型視覚")
+    ],
+    "💻 コーディング": [
+        ("deepseek/deepseek-v3", "DeepSeek V3 - コーディング特化"),
+        ("mistralai/mistral-large", "Mistral Large - 高性能"),
+        ("cohere/command-r-plus", "Command R+ - 推論力")
+    ],
+    "☁️ Amazon": [
+        ("amazon/nova-pro-v1", "Nova Pro - バランス型"),
+        ("amazon/nova-lite-v1", "Nova Lite - 軽量版")
+    ]
+}
+
+# ``` で囲まれたコードブロックを検出
+_CODE_BLOCK_RE = re.compile(r'```(\w+)?\n(.*?)\n```', re.DOTALL)
+
+@lru_cache(maxsize=1)
+def _get_code_formatter():
+    """コードブロックのハイライト用フォーマッタ（初回使用時に生成し全レンダラーで共有）"""
+    from pygments.formatters import HtmlFormatter
+    # インラインのstyle属性ではなくクラス名で出力し、色はスタイルシートで一括指定する
+    return HtmlFormatter(
+        style='default',
+        noclasses=False,
+        cssclass='highlight'
+    )
+
+@lru_cache(maxsize=1)
+def _get_code_css() -> str:
+    """ハイライト用のクラス定義CSS（Pygmentsのスタイルから生成）"""
+    return _get_code_formatter().get_style_defs('.highlight')
+
+@lru_cache(maxsize=128)
+def _get_lexer(language: str):
+    """言語名からレクサーを取得（不明な言語はプレーンテキスト）"""
+    from pygments.lexers import get_lexer_by_name, TextLexer
+    try:
+        return get_lexer_by_name(language)
+    except:
+        return TextLexer()
+
+@lru_cache(maxsize=512)
+def _highlight_code(language: str, code: str) -> str:
+    """コードブロックをハイライト（ストリーミング中の同じブロックはキャッシュから返す）"""
+    from pygments import highlight
+    return highlight(code, _get_lexer(language), _get_code_formatter())
 
 class MarkdownRenderer:
     """マークダウンレンダラー"""
-    
-    def __init__(self):
-        self.formatter = HtmlFormatter(
-            style='default',
-            noclasses=True,
-            cssclass='highlight'
-        )
-        
-    def render_markdown(self, text: str) -> str:
-        """マークダウンテキストをHTMLに変換"""
-        if not text.strip():
-            return ""
-            
-        # コードブロックを事前処理してシンタックスハイライトを適用
-        text = self._process_code_blocks(text)
-        
-        # Markdownを HTMLに変換
-        md = markdown.Markdown(extensions=[
-            'codehilite',
-            'fenced_code', 
-            'tables',
-            'toc'
-        ])
-        
-        html = md.convert(text)
-        
-        # CSSスタイルを追加
-        styled_html = f"""
-        <style>
-            body {{
+    # 出力HTML用のCSS（Pygmentsのクラス定義と合わせてself.cssとして使用）
+    CSS = """
+            body {
                 font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', 'Helvetica Neue', Arial, sans-serif;
                 line-height: 1.6;
                 color: #333;
                 margin: 0;
                 padding: 0;
-            }}
-            h1, h2, h3, h4, h5, h6 {{
+            }
+            h1, h2, h3, h4, h5, h6 {
                 margin-top: 1.5em;
                 margin-bottom: 0.5em;
                 font-weight: 600;
-            }}
-            h1 {{ border-bottom: 2px solid #eee; padding-bottom: 0.3em; }}
-            h2 {{ border-bottom: 1px solid #eee; padding-bottom: 0.3em; }}
-            p {{
+            }
+            h1 { border-bottom: 2px solid #eee; padding-bottom: 0.3em; }
+            h2 { border-bottom: 1px solid #eee; padding-bottom: 0.3em; }
+            p {
                 margin-bottom: 1em;
-            }}
-            code {{
+            }
+            code {
                 background-color: #f8f8f8;
                 color: #e83e8c;
                 padding: 0.2em 0.5em;
@@ -93,8 +224,8 @@ class MarkdownRenderer:
                 font-size: 88%;
                 font-family: 'JetBrains Mono', 'Fira Code', 'SFMono-Regular', Monaco, 'Cascadia Code', 'Roboto Mono', Consolas, 'Courier New', monospace;
                 border: 1px solid #e1e4e8;
-            }}
-            pre {{
+            }
+            pre {
                 background-color: #f8f9fa;
                 color: #333;
                 padding: 16px 20px;
@@ -104,8 +235,8 @@ class MarkdownRenderer:
                 margin: 12px 0;
                 font-size: 14px;
                 line-height: 1.45;
-            }}
-            pre code {{
+            }
+            pre code {
                 background-color: transparent;
                 color: inherit;
                 padding: 0;
@@ -113,159 +244,246 @@ class MarkdownRenderer:
                 border-radius: 0;
                 font-size: inherit;
                 box-shadow: none;
-            }}
-            blockquote {{
+            }
+            blockquote {
                 border-left: 4px solid #dfe2e5;
                 padding-left: 1em;
                 margin-left: 0;
                 color: #6a737d;
-            }}
-            table {{
+            }
+            table {
                 border-collapse: collapse;
                 width: 100%;
                 margin: 1em 0;
-            }}
-            table, th, td {{
+            }
+            table, th, td {
                 border: 1px solid #dfe2e5;
-            }}
-            th, td {{
+            }
+            th, td {
                 padding: 0.5em;
                 text-align: left;
-            }}
-            th {{
+            }
+            th {
                 background-color: #f6f8fa;
                 font-weight: 600;
-            }}
-            ul, ol {{
+            }
+            ul, ol {
                 padding-left: 2em;
-            }}
-            li {{
+            }
+            li {
                 margin-bottom: 0.5em;
-            }}
-            .highlight {{
+            }
+            .highlight {
                 background: #f8f9fa !important;
                 border-radius: 8px;
                 padding: 16px 20px;
                 border: 1px solid #e1e4e8;
                 margin: 12px 0;
                 overflow-x: auto;
-            }}
-            .highlight pre {{
+            }
+            .highlight pre {
                 background: transparent !important;
                 border: none !important;
                 margin: 0 !important;
                 padding: 0 !important;
-            }}
+            }
             /* シンタックスハイライトの色調整 */
-            .highlight .k {{ color: #d73a49; font-weight: 600; }}  /* キーワード */
-            .highlight .s {{ color: #032f62; }}  /* 文字列 */
-            .highlight .c {{ color: #6a737d; font-style: italic; }}  /* コメント */
-            .highlight .n {{ color: #24292e; }}  /* 名前 */
-            .highlight .o {{ color: #d73a49; }}  /* オペレータ */
-            .highlight .p {{ color: #24292e; }}  /* 句読点 */
-        </style>
-        <div>{html}</div>
+            .highlight .k { color: #d73a49; font-weight: 600; }  /* キーワード */
+            .highlight .s { color: #032f62; }  /* 文字列 */
+            .highlight .c { color: #6a737d; font-style: italic; }  /* コメント */
+            .highlight .n { color: #24292e; }  /* 名前 */
+            .highlight .o { color: #d73a49; }  /* オペレータ */
+            .highlight .p { color: #24292e; }  /* 句読点 */
+    """
+    # 出力HTMLを囲むCSS（毎回組み立てないよう定数化）
+    _CSS_SUFFIX = """</div>
         """
+    
+    def __init__(self):
+        import markdown
+        # Pygmentsのクラス定義を先に置き、独自の.highlight指定で上書きする
+        self.css = _get_code_css() + self.CSS
+        self._css_prefix = f"""
+        <style>{self.css}</style>
+        <div>"""
+        # 拡張機能の登録は初回のみ行い、以降はreset()で再利用
+        self._md = markdown.Markdown(extensions=[
+            'codehilite',
+            'fenced_code', 
+            'tables',
+            'toc'
+        ])
+        
+    def render_markdown(self, text: str) -> str:
+        """マークダウンテキストをHTMLに変換"""
+        html = self.render_fragment(text)
+        if not html:
+            return ""
+        
+        # CSSスタイルを追加
+        return self._css_prefix + html + self._CSS_SUFFIX
+        
+    def render_fragment(self, text: str) -> str:
+        """マークダウンテキストをCSSなしのHTML断片に変換"""
+        if not text.strip():
+            return ""
+            
+        # コードブロックを事前処理してシンタックスハイライトを適用
+        text = self._process_code_blocks(text)
         
-        return styled_html
+        # Markdownを HTMLに変換（エンジンは使い回す）
+        self._md.reset()
+        return self._md.convert(text)
         
     def _process_code_blocks(self, text: str) -> str:
         """コードブロックにシンタックスハイライトを適用"""
-        # ``` で囲まれたコードブロックを検出
-        pattern = r'```(\w+)?\n(.*?)\n```'
+        # コードブロックがなければ正規表現による走査自体を省略
+        if '```' not in text:
+            return text
         
         def replace_code_block(match):
             language = match.group(1) or 'text'
             code = match.group(2)
+            return _highlight_code(language, code)
             
-            try:
-                lexer = get_lexer_by_name(language)
-            except:
-                lexer = TextLexer()
-                
-            highlighted = highlight(code, lexer, self.formatter)
-            return highlighted
-            
-        return re.sub(pattern, replace_code_block, text, flags=re.DOTALL)
+        return _CODE_BLOCK_RE.sub(replace_code_block, text)
 
-class ModelInfoManager:
+# Vision対応を判定するキーワード（APIのモデル名・IDに対して使用）
+VISION_KEYWORDS = ['vision', 'gpt-4o', 'claude-3', 'gemini', 'qwen-vl', 'pixtral', 'llama-3.2-90b-vision', 'phi-3.5-vision']
+# API情報がないときにVision対応とみなすモデル
+VISION_MODELS = [
+    'gpt-4o', 'gpt-4-vision', 'claude-3.5-sonnet', 'claude-3-opus', 'claude-3-sonnet', 'claude-3-haiku',
+    'gemini-pro-1.5', 'gemini-flash-1.5', 'qwen-2-vl', 'pixtral', 'llama-3.2-90b-vision', 'phi-3.5-vision'
+]
+# キーワードを1つの正規表現にまとめ、1回の走査で判定する
+_VISION_KEYWORD_RE = re.compile('|'.join(map(re.escape, VISION_KEYWORDS)))
+_VISION_MODEL_RE = re.compile('|'.join(map(re.escape, VISION_MODELS)))
+
+class ModelInfoManager(QObject):
     """モデル情報管理クラス"""
+    info_ready = pyqtSignal(str, dict)  # (モデルID, モデル情報) APIからの取得完了時に通知
+    # 全インスタンスで共有するキャッシュ（ファイルは更新時刻が変わったときだけ読み直す）
+    _shared_cache: Dict = {}
+    _cache_mtime: Optional[float] = None
+    _dirty_count = 0
+    _list_fetched_at = 0.0  # モデル一覧を最後にAPIから取得した時刻
     
     def __init__(self, api_key: str = None):
+        super().__init__()
         self.api_key = api_key
         self.cache = self.load_cache()
+        self._waiting = set()  # 一覧の取得完了を待っているモデルID
+        self._fetching = False  # 一覧を取得中か（同時に複数のリクエストを送らない）
         
     def load_cache(self) -> Dict:
-        """キャッシュを読み込み"""
+        """キャッシュを読み込み（ファイルが前回から変わっていなければ読み込まない）"""
+        cache = ModelInfoManager._shared_cache
         try:
-            with open(MODEL_CACHE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            mtime = os.stat(MODEL_CACHE_FILE).st_mtime
+            if mtime == ModelInfoManager._cache_mtime:
+                return cache
+            with open(MODEL_CACHE_FILE, 'rb') as f:
+                data = _json_loads(f.read())
+            ModelInfoManager._cache_mtime = mtime
+            # 未保存の新しいエントリは残す
+            for model_id, entry in data.items():
+                if entry.get('cached_at', 0) > cache.get(model_id, {}).get('cached_at', 0):
+                    cache[model_id] = entry
         except FileNotFoundError:
-            return {}
+            pass
         except Exception as e:
             print(f"モデルキャッシュ読み込みエラー: {e}")
-            return {}
+        return cache
     
     def save_cache(self):
-        """キャッシュを保存"""
+        """キャッシュを保存（一覧の取得ごとに呼ばれるため、書き込みは最大でもMODEL_LIST_TTLに1回）"""
+        ModelInfoManager._dirty_count += 1
+        ModelInfoManager.flush_cache()
+    
+    @staticmethod
+    def flush_cache():
+        """未保存のキャッシュをファイルに書き出す"""
+        if not ModelInfoManager._dirty_count:
+            return
         try:
-            with open(MODEL_CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, ensure_ascii=False, indent=2)
+            with open(MODEL_CACHE_FILE, 'wb') as f:
+                f.write(_json_dumps(ModelInfoManager._shared_cache))
+            ModelInfoManager._cache_mtime = os.stat(MODEL_CACHE_FILE).st_mtime
+            ModelInfoManager._dirty_count = 0
         except Exception as e:
             print(f"モデルキャッシュ保存エラー: {e}")
     
     def get_model_info(self, model_id: str) -> Dict:
-        """モデル情報を取得（キャッシュ優先）"""
+        """モデル情報を取得（キャッシュ優先）
+        
+        キャッシュにない場合はデフォルト情報を返し、APIからの取得をバックグラウンドで開始する。
+        取得結果はinfo_readyシグナルで通知する。
+        """
         # キャッシュから確認
         if model_id in self.cache:
             cached_info = self.cache[model_id]
             # キャッシュが1週間以内なら使用
-            import time
             if time.time() - cached_info.get('cached_at', 0) < 7 * 24 * 3600:
                 return cached_info.get('info', {})
         
-        # APIから取得
-        return self._fetch_model_info(model_id)
+        # 一覧を最近取得したのに見つからないモデルは再取得しない
+        if not self.api_key or time.time() - ModelInfoManager._list_fetched_at < MODEL_LIST_TTL:
+            return self._get_default_model_info(model_id)
+        
+        # APIから一覧を取得（GUIスレッドをブロックしないようスレッドプールで実行）
+        self._waiting.add(model_id)
+        if not self._fetching:
+            self._fetching = True
+            task = ModelInfoFetchTask(self)
+            task.signals.fetched.connect(self._on_models_fetched)
+            QThreadPool.globalInstance().start(task)
+        return self._get_default_model_info(model_id)
     
-    def _fetch_model_info(self, model_id: str) -> Dict:
-        """OpenRouter APIからモデル情報を取得"""
+    def _on_models_fetched(self, models: Optional[Dict[str, Dict]]):
+        """取得した全モデルの情報をキャッシュに保存して通知（GUIスレッドで実行）"""
+        self._fetching = False
+        waiting, self._waiting = self._waiting, set()
+        if models is None:
+            models = {}
+        else:
+            now = time.time()
+            for model_id, model_info in models.items():
+                self.cache[model_id] = {
+                    'info': model_info,
+                    'cached_at': now
+                }
+            ModelInfoManager._list_fetched_at = now
+            self.save_cache()
+        
+        for model_id in waiting:
+            # モデルが見つからない場合はデフォルト情報を通知
+            self.info_ready.emit(model_id, models.get(model_id) or self._get_default_model_info(model_id))
+    
+    def _fetch_all_model_info(self) -> Optional[Dict[str, Dict]]:
+        """OpenRouter APIから全モデルの情報を取得（失敗時はNone）"""
         try:
-            if not self.api_key:
-                return self._get_default_model_info(model_id)
-                
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json"
             }
             
-            response = requests.get(
+            response = _HTTP.get(
                 "https://openrouter.ai/api/v1/models",
                 headers=headers,
                 timeout=10
             )
             
             if response.status_code == 200:
-                models_data = response.json()
-                for model in models_data.get('data', []):
-                    if model.get('id') == model_id:
-                        model_info = self._process_model_info(model)
-                        
-                        # キャッシュに保存
-                        import time
-                        self.cache[model_id] = {
-                            'info': model_info,
-                            'cached_at': time.time()
-                        }
-                        self.save_cache()
-                        
-                        return model_info
+                models_data = _json_loads(response.content)
+                # 一覧全体が返るので、要求されたモデル以外もまとめてキャッシュする
+                return {model['id']: self._process_model_info(model)
+                        for model in models_data.get('data', []) if model.get('id')}
             
-            # モデルが見つからない場合はデフォルト情報を返す
-            return self._get_default_model_info(model_id)
+            return None
             
         except Exception as e:
             print(f"モデル情報取得エラー: {e}")
-            return self._get_default_model_info(model_id)
+            return None
     
     def _process_model_info(self, model_data: Dict) -> Dict:
         """APIレスポンスからモデル情報を処理"""
@@ -277,8 +495,7 @@ class ModelInfoManager:
         model_id = model_data.get('id', '').lower()
         
         # Vision対応モデルを検出
-        vision_keywords = ['vision', 'gpt-4o', 'claude-3', 'gemini', 'qwen-vl', 'pixtral', 'llama-3.2-90b-vision', 'phi-3.5-vision']
-        if any(keyword in model_name or keyword in model_id for keyword in vision_keywords):
+        if _VISION_KEYWORD_RE.search(model_name) or _VISION_KEYWORD_RE.search(model_id):
             input_types.append('image')
         
         return {
@@ -305,18 +522,29 @@ class ModelInfoManager:
         }
         
         # Vision対応モデルの判定
-        vision_models = [
-            'gpt-4o', 'gpt-4-vision', 'claude-3.5-sonnet', 'claude-3-opus', 'claude-3-sonnet', 'claude-3-haiku',
-            'gemini-pro-1.5', 'gemini-flash-1.5', 'qwen-2-vl', 'pixtral', 'llama-3.2-90b-vision', 'phi-3.5-vision'
-        ]
-        
-        for vision_model in vision_models:
-            if vision_model in model_id.lower():
-                default_info['input_types'].append('image')
-                break
-                
+        if _VISION_MODEL_RE.search(model_id.lower()):
+            default_info['input_types'].append('image')
+            
         return default_info
 
+# 保存に失敗したキャッシュは終了時にもう一度書き出す
+atexit.register(ModelInfoManager.flush_cache)
+
+class ModelInfoFetchSignals(QObject):
+    """モデル情報取得完了通知用シグナル"""
+    fetched = pyqtSignal(object)  # {モデルID: モデル情報} または失敗時None
+
+class ModelInfoFetchTask(QRunnable):
+    """モデル一覧をバックグラウンドでAPIから取得するタスク"""
+    def __init__(self, manager: ModelInfoManager):
+        super().__init__()
+        self.manager = manager
+        self.signals = ModelInfoFetchSignals()
+        
+    def run(self):
+        # キャッシュの更新は受信側（GUIスレッド）で行う
+        self.signals.fetched.emit(self.manager._fetch_all_model_info())
+
 class CustomModelDialog(QDialog):
     """カスタムモデル追加ダイアログ"""
     def __init__(self, parent=None):
@@ -392,8 +620,12 @@ class ConfigDialog(QDialog):
         self.base_url_edit.setText("https://openrouter.ai/api/v1")
         self.base_url_edit.setPlaceholderText("ベースURL")
         
+        self.upload_url_edit = QLineEdit()
+        self.upload_url_edit.setPlaceholderText("大きな画像のアップロード先URL（オプション）")
+        
         layout.addRow("APIキー:", self.api_key_edit)
         layout.addRow("ベースURL:", self.base_url_edit)
+        layout.addRow("アップロードURL:", self.upload_url_edit)
         
         buttons = QDialogButtonBox(
             QDialogButtonBox.StandardButton.Ok | 
@@ -411,61 +643,52 @@ class ConfigDialog(QDialog):
         """設定を読み込み"""
         try:
             # keyringからAPIキーを取得
-            api_key = keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME)
+            api_key = _get_api_key()
             if api_key:
                 self.api_key_edit.setText(api_key)
             
-            # その他の設定をJSONファイルから取得
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                self.base_url_edit.setText(config.get('base_url', 'https://openrouter.ai/api/v1'))
-        except FileNotFoundError:
-            self.base_url_edit.setText('https://openrouter.ai/api/v1')
+            # その他の設定を取得
+            config = _read_config()
+            self.base_url_edit.setText(config.get('base_url', 'https://openrouter.ai/api/v1'))
+            self.upload_url_edit.setText(config.get('upload_url', ''))
         except Exception as e:
             print(f"設定読み込みエラー: {e}")
             
     def save_config(self):
         """設定を保存"""
         try:
-            # APIキーをkeyringに保存
-            api_key = self.api_key_edit.text()
-            if api_key:
-                keyring.set_password(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
-            else:
-                # APIキーが空の場合は削除
-                try:
-                    keyring.delete_password(KEYRING_SERVICE, KEYRING_USERNAME)
-                except keyring.errors.PasswordDeleteError:
-                    pass
+            # APIキーをkeyringに保存（空の場合は削除）
+            _set_api_key(self.api_key_edit.text())
             
             # その他の設定をJSONファイルに保存（APIキーは除く）
-            config = {
-                'base_url': self.base_url_edit.text()
-            }
-            # 既存のカスタムモデルを保持
-            try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    existing_config = json.load(f)
-                    config['custom_models'] = existing_config.get('custom_models', [])
-            except FileNotFoundError:
-                config['custom_models'] = []
-            
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
+            # 既存のカスタムモデル等はキャッシュ済みの設定から引き継ぐ
+            config = dict(_read_config())
+            config['base_url'] = self.base_url_edit.text()
+            config['upload_url'] = self.upload_url_edit.text().strip()
+            config.setdefault('custom_models', [])
+            _write_config(config)
         except Exception as e:
             print(f"設定保存エラー: {e}")
             raise
 
 class AttachedFile:
     """添付ファイルクラス"""
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, file_stat: os.stat_result = None):
         self.file_path = file_path
         self.file_name = os.path.basename(file_path)
-        self.file_size = os.path.getsize(file_path)
+        # 呼び出し元でstat済みならその結果を使い、stat呼び出しは1回に抑える
+        file_stat = file_stat or os.stat(file_path)
+        self.file_size = file_stat.st_size
+        self.mtime = file_stat.st_mtime
         self.mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        self._is_image = self.mime_type.startswith('image/')
+        self._b64_prefix = f"data:{self.mime_type};base64,"
+        # エンコード結果のキャッシュ（data URLのみ保持し、更新時刻が変わったら破棄）
+        self._data_url = None
+        self._data_url_mtime = None
         
     def is_image(self) -> bool:
-        return self.mime_type.startswith('image/')
+        return self._is_image
         
     def is_document(self) -> bool:
         return self.mime_type in ['application/pdf', 'application/msword', 
@@ -474,16 +697,46 @@ class AttachedFile:
     def is_audio(self) -> bool:
         return self.mime_type.startswith('audio/')
         
-    def get_base64_content(self) -> str:
-        """Base64エンコードされたファイル内容を取得"""
+    def get_data_url(self) -> str:
+        """data URL形式のファイル内容を取得"""
         try:
+            mtime = os.path.getmtime(self.file_path)
+            if self._data_url is not None and self._data_url_mtime == mtime:
+                return self._data_url
+                
+            # 3の倍数サイズで分割読み込みすることでパディングなしに連結でき、
+            # ファイル全体をメモリに読み込まずに済む
+            # プレフィックスも同じバッファに書き込み、文字列への変換は最後の1回だけにする
+            buf = bytearray(self._b64_prefix.encode('ascii'))
             with open(self.file_path, 'rb') as f:
-                content = base64.b64encode(f.read()).decode('utf-8')
-                print(f"Base64エンコード完了: {self.file_name}, 長さ: {len(content)}")
-                return content
+                while chunk := f.read(BASE64_CHUNK_SIZE):
+                    buf += _b64.b64encode(chunk)
+            self._data_url = buf.decode('ascii')
+            self._data_url_mtime = mtime
+            return self._data_url
         except Exception as e:
             print(f"ファイル読み込みエラー ({self.file_name}): {e}")
             return ""
+        
+    def upload(self, upload_url: str) -> str:
+        """ファイルをアップロード先にPUTし、参照用のURLを取得"""
+        try:
+            # 同名の別ファイルや過去の会話の画像を上書きしないよう、一意な名前にする（拡張子は維持）
+            object_name = uuid.uuid4().hex + os.path.splitext(self.file_name)[1]
+            url = f"{upload_url.rstrip('/')}/{quote(object_name)}"
+            with open(self.file_path, 'rb') as f:
+                response = _HTTP.put(
+                    url,
+                    data=f,
+                    headers={"Content-Type": self.mime_type},
+                    timeout=60
+                )
+            if response.ok:
+                return response.headers.get('Location', url)
+            print(f"アップロードエラー ({self.file_name}): {response.status_code}")
+        except Exception as e:
+            print(f"アップロードエラー ({self.file_name}): {e}")
+        return ""
 
 class FileListWidget(QListWidget):
     """ファイルリストウィジェット"""
@@ -512,17 +765,21 @@ class FileListWidget(QListWidget):
         
     def add_file(self, file_path: str):
         """ファイルを追加"""
-        if not os.path.isfile(file_path):
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return
+        if not stat.S_ISREG(file_stat.st_mode):
             return
             
-        attached_file = AttachedFile(file_path)
+        attached_file = AttachedFile(file_path, file_stat)
         self.attached_files.append(attached_file)
         
         # リストアイテムを作成
         item = QListWidgetItem()
         file_info = f"📎 {attached_file.file_name} ({self.format_file_size(attached_file.file_size)})"
         item.setText(file_info)
-        item.setData(Qt.ItemDataRole.UserRole, len(self.attached_files) - 1)
+        item.setData(Qt.ItemDataRole.UserRole, attached_file)
         self.addItem(item)
         
         # コンテキストメニュー
@@ -549,23 +806,13 @@ class FileListWidget(QListWidget):
         action = menu.exec(event.globalPos())
         
         if action == delete_action:
-            index = item.data(Qt.ItemDataRole.UserRole)
-            self.remove_file(index)
+            self.remove_file(self.row(item))
             
     def remove_file(self, index: int):
         """ファイルを削除"""
         if 0 <= index < len(self.attached_files):
-            del self.attached_files[index]
-            self.clear()
-            
-            # リストを再構築
-            for i, attached_file in enumerate(self.attached_files):
-                item = QListWidgetItem()
-                file_info = f"📎 {attached_file.file_name} ({self.format_file_size(attached_file.file_size)})"
-                item.setText(file_info)
-                item.setData(Qt.ItemDataRole.UserRole, i)
-                self.addItem(item)
-                
+            # 項目はAttachedFile自体を保持するので、番号の振り直しは不要
+            self.attached_files.remove(self.takeItem(index).data(Qt.ItemDataRole.UserRole))
             self.files_changed.emit(self.attached_files)
             
     def clear_files(self):
@@ -574,31 +821,144 @@ class FileListWidget(QListWidget):
         self.clear()
         self.files_changed.emit(self.attached_files)
 
+class ImageLoadSignals(QObject):
+    """画像読み込み完了通知用シグナル"""
+    loaded = pyqtSignal(str, QImage)
+
+class ImageLoadTask(QRunnable):
+    """画像のデコードと縮小をバックグラウンドで行うタスク"""
+    def __init__(self, image_path: str):
+        super().__init__()
+        self.image_path = image_path
+        self.signals = ImageLoadSignals()
+        
+    def run(self):
+        # QPixmapはGUIスレッド専用のため、ここではQImageで処理する
+        # デコード時に縮小することで（JPEGではDCTスケーリング）フル解像度の展開を避ける
+        reader = QImageReader(self.image_path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid():
+            size.scale(300, 300, Qt.AspectRatioMode.KeepAspectRatio)
+            reader.setScaledSize(size)
+        image = reader.read()
+        if not image.isNull() and (image.width() > 300 or image.height() > 300):
+            # ヘッダーからサイズを取得できない形式は読み込み後に縮小
+            image = image.scaled(300, 300, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        self.signals.loaded.emit(self.image_path, image)
+
 class ChatBubble(QFrame):
     """チャット吹き出し"""
+    # 全バブルで共有するレンダラー（最初のバブル生成時に作成）
+    _shared_renderer: Optional[MarkdownRenderer] = None
+    
     def __init__(self, message: str, is_user: bool = False, images: List[str] = None):
         super().__init__()
         self.is_user = is_user
-        self.markdown_renderer = MarkdownRenderer()
+        if ChatBubble._shared_renderer is None:
+            ChatBubble._shared_renderer = MarkdownRenderer()
+        self.markdown_renderer = ChatBubble._shared_renderer
         self.current_message = message
         self.text_browser = None  # ストリーミング用参照を保持
+        self._pending_images: Dict[str, tuple] = {}  # 読み込み待ちの画像
+        # ストリーミング描画の状態
+        self._committed_len = 0  # 文書に確定済みのメッセージ文字数
+        self._tail_start = 0  # 未確定部分（末尾）の文書内の開始位置
+        self._render_timer = None
         self.setup_ui(message, images or [])
         
     def update_message(self, new_content: str):
         """メッセージを更新（ストリーミング用）"""
         if not self.is_user and self.text_browser:
             self.current_message += new_content
-            try:
-                # HTMLを更新してカーソルを最後に移動
-                self.text_browser.setHtml(self.markdown_renderer.render_markdown(self.current_message))
-                # カーソルを文書の最後に移動
-                cursor = self.text_browser.textCursor()
-                cursor.movePosition(cursor.MoveOperation.End)
-                self.text_browser.setTextCursor(cursor)
-            except Exception as e:
-                print(f"テキストブラウザ更新エラー: {e}")
-                # エラー時は安全にプレーンテキストで表示
-                self.text_browser.setPlainText(self.current_message)
+            # 空白だけのチャンクでは再描画しない（次のチャンクか完了時にまとめて描画）
+            if not new_content or (new_content.isspace() and '\n' not in new_content):
+                return
+            # 連続するチャンクは30ms間隔でまとめて描画
+            if not self._render_timer.isActive():
+                self._render_timer.start()
+                
+    def finish_message(self):
+        """ストリーミング完了時にメッセージ全体を描画し直す"""
+        if not self.is_user and self.text_browser:
+            self._render_timer.stop()
+            self.text_browser.setHtml(self.markdown_renderer.render_markdown(self.current_message))
+            
+    def _render_streaming(self):
+        """確定した部分だけを文書に追加し、未確定の末尾のみ描画し直す"""
+        try:
+            text = self.current_message
+            cursor = QTextCursor(self.text_browser.document())
+            
+            # 前回描画した未確定部分を削除
+            cursor.setPosition(self._tail_start)
+            cursor.movePosition(QTextCursor.MoveOperation.End, QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+            
+            # 新たに確定した段落を追加
+            boundary = self._stable_boundary(text)
+            if boundary > self._committed_len:
+                cursor.insertHtml(self.markdown_renderer.render_fragment(text[self._committed_len:boundary]))
+                # 末尾は書式を引き継がない新しいブロックに描画
+                cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+                self._committed_len = boundary
+                self._tail_start = cursor.position()
+            
+            cursor.insertHtml(self.markdown_renderer.render_fragment(text[self._committed_len:]))
+        except Exception as e:
+            print(f"テキストブラウザ更新エラー: {e}")
+            # エラー時は安全にプレーンテキストで表示
+            self.text_browser.setPlainText(self.current_message)
+            
+    def _resize_to_content(self):
+        """文書の高さに合わせてテキストブラウザの高さを設定（変化がなければ何もしない）"""
+        height = int(self.text_browser.document().documentLayout().documentSize().height())
+        if height != self.text_browser.height():
+            self.text_browser.setFixedHeight(height)
+            
+    def _stable_boundary(self, text: str) -> int:
+        """確定済みとして描画できる位置（コードブロック外の最後の空行の直後）を取得"""
+        pos = text.rfind('\n\n', self._committed_len)
+        while pos != -1:
+            # 確定済み部分はフェンスが閉じているので、それ以降の```の数で判定
+            if text.count('```', self._committed_len, pos) % 2 == 0:
+                return pos + 2
+            pos = text.rfind('\n\n', self._committed_len, pos)
+        return self._committed_len
+        
+    def _load_image(self, image_label: QLabel, image_path: str):
+        """画像をラベルに表示（キャッシュがなければバックグラウンドでデコード）"""
+        # 縮小済み画像はQPixmapCache（Qt全体で共有されるLRU）に保持
+        key = f"chat_image:{os.path.abspath(image_path)}:{os.path.getmtime(image_path)}"
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None:
+            image_label.setPixmap(pixmap)
+            return
+        
+        # 読み込み完了までは非表示
+        image_label.hide()
+        if image_path in self._pending_images:
+            self._pending_images[image_path][1].append(image_label)
+            return
+        self._pending_images[image_path] = (key, [image_label])
+        
+        task = ImageLoadTask(image_path)
+        task.signals.loaded.connect(self._on_image_loaded)
+        QThreadPool.globalInstance().start(task)
+        
+    def _on_image_loaded(self, image_path: str, image: QImage):
+        """画像読み込み完了時の処理"""
+        key, labels = self._pending_images.pop(image_path, (None, []))
+        if key is None or image.isNull():
+            return
+        
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(key, pixmap)
+        
+        for image_label in labels:
+            image_label.setPixmap(pixmap)
+            image_label.show()
         
     def setup_ui(self, message: str, images: List[str]):
         layout = QVBoxLayout()
@@ -608,14 +968,9 @@ class ChatBubble(QFrame):
         for image_path in images:
             if os.path.exists(image_path):
                 image_label = QLabel()
-                pixmap = QPixmap(image_path)
-                if not pixmap.isNull():
-                    # 画像をリサイズ
-                    pixmap = pixmap.scaled(300, 300, Qt.AspectRatioMode.KeepAspectRatio, 
-                                         Qt.TransformationMode.SmoothTransformation)
-                    image_label.setPixmap(pixmap)
-                    image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-                    layout.addWidget(image_label)
+                image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+                layout.addWidget(image_label)
+                self._load_image(image_label, image_path)
         
         # テキスト表示
         if self.is_user:
@@ -632,95 +987,72 @@ class ChatBubble(QFrame):
         else:
             # AIメッセージはマークダウンレンダリング
             self.text_browser = QTextBrowser()
+            # 断片的に追加するHTMLにも同じCSSが適用されるよう既定スタイルシートに設定
+            self.text_browser.document().setDefaultStyleSheet(self.markdown_renderer.css)
             self.text_browser.setHtml(self.markdown_renderer.render_markdown(message))
             self.text_browser.setOpenExternalLinks(True)
             self.text_browser.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
             self.text_browser.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
             
-            # コンテンツサイズに合わせて高さを自動調整
+            # コンテンツサイズに合わせて高さを自動調整（変化はイベントループ1周分まとめて反映）
+            self._resize_timer = QTimer(self)
+            self._resize_timer.setSingleShot(True)
+            self._resize_timer.setInterval(0)
+            self._resize_timer.timeout.connect(self._resize_to_content)
             self.text_browser.document().documentLayout().documentSizeChanged.connect(
-                lambda size: self.text_browser.setFixedHeight(int(size.height()))
+                lambda size: self._resize_timer.start()
             )
             
-            # QTextBrowserのスタイルを調整
-            self.text_browser.setStyleSheet("""
-                QTextBrowser {
-                    background-color: transparent;
-                    border: none;
-                    font-size: 11px;
-                }
-            """)
-            
             layout.addWidget(self.text_browser)
+            
+            self._render_timer = QTimer(self)
+            self._render_timer.setSingleShot(True)
+            self._render_timer.setInterval(30)
+            self._render_timer.timeout.connect(self._render_streaming)
         
         self.setLayout(layout)
         
-        # スタイル設定
-        if self.is_user:
-            self.setStyleSheet("""
-                QFrame {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #667eea, stop: 1 #764ba2);
-                    border-radius: 18px;
-                    margin-left: 60px;
-                    margin-right: 15px;
-                    margin-top: 8px;
-                    margin-bottom: 8px;
-                    border: 2px solid rgba(255, 255, 255, 0.3);
-                }
-                QLabel {
-                    color: white;
-                    background-color: transparent;
-                    font-weight: 500;
-                }
-            """)
-        else:
-            self.setStyleSheet("""
-                QFrame {
-                    background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                        stop: 0 #ffffff, stop: 1 #f7fafc);
-                    border-radius: 18px;
-                    margin-left: 15px;
-                    margin-right: 60px;
-                    margin-top: 8px;
-                    margin-bottom: 8px;
-                    border: 2px solid #e2e8f0;
-                }
-                QLabel {
-                    color: #2d3748;
-                    background-color: transparent;
-                    font-weight: 500;
-                }
-                QTextBrowser {
-                    background-color: transparent;
-                    border: none;
-                    color: #2d3748;
-                }
-            """)
+        # スタイルはMainWindowの共通スタイルシートでオブジェクト名により適用
+        self.setObjectName("UserBubble" if self.is_user else "BotBubble")
 
-class OpenRouterAPIThread(QThread):
-    """OpenRouter API呼び出しスレッド"""
-    message_received = pyqtSignal(str)
-    message_chunk_received = pyqtSignal(str)  # ストリーミング用
-    error_occurred = pyqtSignal(str)
+class OpenRouterAPIWorker(QObject):
+    """OpenRouter API呼び出しワーカー（リクエストごとに専用スレッドプール上のタスクで処理）"""
+    message_received = pyqtSignal(int, str)  # (リクエストID, 全体メッセージ)
+    message_chunk_received = pyqtSignal(int, str)  # ストリーミング用
+    error_occurred = pyqtSignal(int, str)
     
-    def __init__(self, api_key: str, base_url: str, model: str, messages: List[Dict], attached_files: List[AttachedFile]):
+    def __init__(self):
         super().__init__()
-        self.api_key = api_key
-        self.base_url = base_url
-        self.model = model
-        self.messages = messages
-        self.attached_files = attached_files
-        self._stop_requested = False
-        self._response = None
-        
-    def run(self):
+        self._cancelled_id = 0  # このID以下のリクエストは停止済み
+        self._responses: Dict[int, requests.Response] = {}  # 受信中のレスポンス（リクエストID → レスポンス）
+        # 停止したリクエストが通信待ちのままでも、次のリクエストを待たせずに処理する
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(8)
+        
+    def _is_cancelled(self, request_id: int) -> bool:
+        return request_id <= self._cancelled_id
+        
+    def process_request(self, request: Dict):
+        """リクエストをスレッドプールで処理開始（GUIスレッドから呼び出し）"""
+        self._pool.start(APIRequestTask(self, request))
+        
+    def wait_for_done(self, msecs: int):
+        """実行中のリクエストの終了を待つ"""
+        self._pool.waitForDone(msecs)
+        
+    def _run_request(self, request: Dict):
+        """リクエストを処理（スレッドプール上で実行）"""
+        request_id = request['request_id']
+        messages = request['messages']
+        attached_files = request['attached_files']
+        upload_url = request.get('upload_url', '')
+        response = None
         try:
-            if self._stop_requested:
+            if self._is_cancelled(request_id):
                 return
                 
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {request['api_key']}",
                 "Content-Type": "application/json"
             }
             
@@ -728,8 +1060,8 @@ class OpenRouterAPIThread(QThread):
             api_messages = []
             
             # 最後のユーザーメッセージに添付ファイルを含める
-            for i, msg in enumerate(self.messages):
-                if msg['role'] == 'user' and i == len(self.messages) - 1:
+            for i, msg in enumerate(messages):
+                if msg['role'] == 'user' and i == len(messages) - 1:
                     # 最新のユーザーメッセージの場合
                     content = []
                     
@@ -740,16 +1072,19 @@ class OpenRouterAPIThread(QThread):
                             "text": msg['content']
                         })
                     
-                    # 画像添付がある場合
-                    for attached_file in self.attached_files:
-                        if attached_file.is_image():
-                            print(f"画像を処理中: {attached_file.file_name}")
-                            base64_content = attached_file.get_base64_content()
-                            if base64_content:
+                    # 画像添付がある場合（複数画像は並列にエンコード）
+                    image_files = [f for f in attached_files if f.is_image()]
+                    if image_files:
+                        with ThreadPoolExecutor(max_workers=min(4, len(image_files))) as executor:
+                            image_urls = list(executor.map(
+                                lambda f: self._get_image_url(f, upload_url), image_files
+                            ))
+                        for attached_file, image_url in zip(image_files, image_urls):
+                            if image_url:
                                 content.append({
                                     "type": "image_url",
                                     "image_url": {
-                                        "url": f"data:{attached_file.mime_type};base64,{base64_content}"
+                                        "url": image_url
                                     }
                                 })
                                 print(f"画像を追加しました: {attached_file.file_name}")
@@ -766,68 +1101,338 @@ class OpenRouterAPIThread(QThread):
                     })
             
             data = {
-                "model": self.model,
+                "model": request['model'],
                 "messages": api_messages,
                 "max_tokens": 2000,
                 "temperature": 0.7,
                 "stream": True
             }
             
-            if self._stop_requested:
+            if self._is_cancelled(request_id):
                 return
                 
-            self._response = requests.post(
-                f"{self.base_url}/chat/completions",
+            response = _HTTP.post(
+                f"{request['base_url']}/chat/completions",
                 headers=headers,
-                json=data,
+                data=_json_dumps(data),  # 大きな画像を含むため高速なシリアライザで事前に変換
                 timeout=60,
                 stream=True
             )
-            response = self._response
+            self._responses[request_id] = response
+            # ヘッダー待ちの間に停止された場合は受信せずに終了
+            if self._is_cancelled(request_id):
+                response.close()
+                return
             
             if response.status_code == 200:
                 full_message = ""
-                for line in response.iter_lines():
-                    if self._stop_requested:
+                # 1回の受信で届いた差分はまとめてからGUIスレッドへ通知する
+                pending = []
+                # 受信したバイト列のまま行を切り出し、JSON部分だけをパースする
+                buf = bytearray()
+                done = False
+                chunks = response.iter_content(chunk_size=None)
+                for data in chunks:
+                    if self._is_cancelled(request_id):
+                        break
+                    buf += data
+                    start = 0
+                    while (end := buf.find(b'\n', start)) != -1:
+                        line = buf[start:end]
+                        start = end + 1
+                        if not line.startswith(b'data: '):
+                            continue
+                        payload = bytes(line[6:]).strip()  # 'data: 'を除去
+                        if payload == b'[DONE]':
+                            done = True
+                            break
+                        content = self._extract_content(payload)
+                        if content:
+                            full_message += content
+                            pending.append(content)
+                    del buf[:start]
+                    # 受信分を処理し終えたら、次の受信を待たずに通知する
+                    # （再描画の間引きはChatBubbleのタイマーで行う）
+                    if pending and not self._is_cancelled(request_id):
+                        self.message_chunk_received.emit(request_id, "".join(pending))
+                        pending.clear()
+                    if done:
                         break
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            json_str = line[6:]  # 'data: 'を除去
-                            if json_str.strip() == '[DONE]':
-                                break
-                            try:
-                                chunk_data = json.loads(json_str)
-                                if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                                    delta = chunk_data['choices'][0].get('delta', {})
-                                    if 'content' in delta:
-                                        content = delta['content']
-                                        full_message += content
-                                        self.message_chunk_received.emit(content)
-                            except json.JSONDecodeError:
-                                continue
                 
-                if not self._stop_requested:
-                    self.message_received.emit(full_message)  # 完了時に全体メッセージを送信
+                if not self._is_cancelled(request_id):
+                    self.message_received.emit(request_id, full_message)  # 完了時に全体メッセージを送信
+                if done:
+                    # [DONE]の後の終端チャンクまで読み切り、接続をプールに戻して次回の送信で再利用する
+                    # （途中で読むのをやめると接続は破棄される）
+                    for _ in chunks:
+                        pass
             else:
-                if not self._stop_requested:
-                    self.error_occurred.emit(f"API エラー: {response.status_code} - {response.text}")
+                if not self._is_cancelled(request_id):
+                    self.error_occurred.emit(request_id, f"API エラー: {response.status_code} - {response.text}")
                 
         except Exception as e:
-            if not self._stop_requested:
-                self.error_occurred.emit(f"エラーが発生しました: {str(e)}")
+            if not self._is_cancelled(request_id):
+                self.error_occurred.emit(request_id, f"エラーが発生しました: {str(e)}")
+        finally:
+            self._responses.pop(request_id, None)
+            # エラー・停止時も接続を確実に解放する
+            if response is not None:
+                response.close()
     
-    def stop(self):
-        """推論を停止"""
-        self._stop_requested = True
-        if self._response:
+    def _extract_content(self, payload: bytes) -> Optional[str]:
+        """SSEのdata部分から追加されたテキストを取得"""
+        # よくある単純なテキスト差分はJSONをパースせずに切り出す
+        # （エスケープを含む場合やツール呼び出し等はパースする）
+        start = payload.find(b'"content":"')
+        if (start > 0 and payload[start - 1] != 0x5C  # 0x5C = バックスラッシュ
+                and payload.find(b'"content":"', start + 1) == -1
+                and b'"tool_calls"' not in payload):
+            start += 11
+            end = payload.find(b'"', start)
+            if end != -1 and payload.find(b'\\', start, end) == -1:
+                return payload[start:end].decode('utf-8')
+        try:
+            chunk_data = _json_loads(payload)
+        except json.JSONDecodeError:
+            return None
+        choices = chunk_data.get('choices')
+        if choices:
+            return choices[0].get('delta', {}).get('content')
+        return None
+    
+    def _get_image_url(self, attached_file: AttachedFile, upload_url: str) -> str:
+        """画像の送信用URLを取得（大きな画像はアップロード、失敗時はdata URL）"""
+        if upload_url and attached_file.file_size > UPLOAD_THRESHOLD:
+            url = attached_file.upload(upload_url)
+            if url:
+                return url
+        return attached_file.get_data_url()
+    
+    def cancel(self, request_id: int):
+        """推論を停止（GUIスレッドから呼び出し）"""
+        self._cancelled_id = max(self._cancelled_id, request_id)
+        response = self._responses.get(request_id)
+        if response:
             try:
-                self._response.close()
+                response.close()
             except:
                 pass
 
+class APIRequestTask(QRunnable):
+    """1件のAPIリクエストをバックグラウンドで処理するタスク"""
+    def __init__(self, worker: OpenRouterAPIWorker, request: Dict):
+        super().__init__()
+        self.worker = worker
+        self.request = request
+        
+    def run(self):
+        self.worker._run_request(self.request)
+
+# 入力タイプごとの表示アイコン（この順に並べて表示）
+INPUT_TYPE_ICONS = {
+    'text': '📝',
+    'image': '🖼️',
+    'audio': '🎵',
+    'video': '🎥'
+}
+
+# メインウィンドウのスタイルシート（吹き出しのスタイルもオブジェクト名で指定）
+MAIN_STYLESHEET = """
+    QMainWindow {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #f8f9ff, stop: 1 #e6f3ff);
+    }
+    QTextEdit {
+        border: 2px solid #d1d9ff;
+        border-radius: 12px;
+        padding: 12px;
+        font-size: 13px;
+        background-color: #ffffff;
+        color: #2d3748;
+    }
+    QTextEdit:focus {
+        border-color: #667eea;
+    }
+    QPushButton {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #667eea, stop: 1 #764ba2);
+        color: white;
+        border: none;
+        border-radius: 10px;
+        padding: 12px 24px;
+        font-weight: 600;
+        font-size: 13px;
+        min-height: 20px;
+    }
+    QPushButton:hover {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #5a67d8, stop: 1 #6b46c1);
+    }
+    QPushButton:pressed {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #553c9a, stop: 1 #5b21b6);
+    }
+    QPushButton[objectName="stop_btn"] {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #e53e3e, stop: 1 #c53030);
+    }
+    QPushButton[objectName="stop_btn"]:hover {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #fc8181, stop: 1 #e53e3e);
+    }
+    QPushButton[objectName="stop_btn"]:pressed {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #c53030, stop: 1 #9c2a2a);
+    }
+    QComboBox {
+        border: 2px solid #d1d9ff;
+        border-radius: 10px;
+        padding: 8px 12px;
+        background-color: #ffffff;
+        color: #2d3748;
+        font-size: 13px;
+        font-weight: 500;
+        min-height: 20px;
+    }
+    QComboBox:hover {
+        border-color: #667eea;
+        background-color: #f7fafc;
+    }
+    QComboBox:focus {
+        border-color: #667eea;
+    }
+    QComboBox::drop-down {
+        border: none;
+        border-top-right-radius: 10px;
+        border-bottom-right-radius: 10px;
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #667eea, stop: 1 #764ba2);
+        width: 30px;
+    }
+    QComboBox::down-arrow {
+        image: none;
+        border: 4px solid transparent;
+        border-top: 6px solid white;
+        margin: 0 8px;
+    }
+    QComboBox QAbstractItemView {
+        border: 2px solid #d1d9ff;
+        border-radius: 10px;
+        background-color: #ffffff;
+        selection-background-color: #667eea;
+        selection-color: white;
+        color: #2d3748;
+        font-size: 13px;
+        padding: 4px;
+        outline: none;
+    }
+    QComboBox QAbstractItemView::item {
+        border: none;
+        padding: 8px 12px;
+        margin: 2px;
+        border-radius: 6px;
+        min-height: 20px;
+    }
+    QComboBox QAbstractItemView::item:hover {
+        background-color: #e6f3ff;
+        color: #2d3748;
+    }
+    QComboBox QAbstractItemView::item:selected {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #667eea, stop: 1 #764ba2);
+        color: white;
+        font-weight: 600;
+    }
+    QComboBox QAbstractItemView::item:disabled {
+        color: #a0aec0;
+        background-color: transparent;
+        font-style: italic;
+    }
+    QScrollArea {
+        border: 2px solid #d1d9ff;
+        border-radius: 12px;
+        background-color: #ffffff;
+    }
+    QListWidget {
+        border: 2px solid #d1d9ff;
+        border-radius: 10px;
+        background-color: #f7fafc;
+        alternate-background-color: #ffffff;
+        color: #2d3748;
+        font-size: 12px;
+    }
+    QListWidget::item {
+        padding: 8px;
+        border-radius: 6px;
+        margin: 2px;
+    }
+    QListWidget::item:hover {
+        background-color: #e6f3ff;
+    }
+    QListWidget::item:selected {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #667eea, stop: 1 #764ba2);
+        color: white;
+    }
+    QLabel {
+        color: #2d3748;
+        font-weight: 500;
+    }
+    QProgressBar {
+        border: 2px solid #d1d9ff;
+        border-radius: 8px;
+        background-color: #f7fafc;
+        text-align: center;
+        font-weight: 600;
+        color: #2d3748;
+    }
+    QProgressBar::chunk {
+        background: qlineargradient(x1: 0, y1: 0, x2: 1, y2: 0,
+            stop: 0 #667eea, stop: 1 #764ba2);
+        border-radius: 6px;
+        margin: 2px;
+    }
+    QFrame#UserBubble {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #667eea, stop: 1 #764ba2);
+        border-radius: 18px;
+        margin-left: 60px;
+        margin-right: 15px;
+        margin-top: 8px;
+        margin-bottom: 8px;
+        border: 2px solid rgba(255, 255, 255, 0.3);
+    }
+    QFrame#UserBubble QLabel {
+        color: white;
+        background-color: transparent;
+        font-weight: 500;
+    }
+    QFrame#BotBubble {
+        background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
+            stop: 0 #ffffff, stop: 1 #f7fafc);
+        border-radius: 18px;
+        margin-left: 15px;
+        margin-right: 60px;
+        margin-top: 8px;
+        margin-bottom: 8px;
+        border: 2px solid #e2e8f0;
+    }
+    QFrame#BotBubble QLabel {
+        color: #2d3748;
+        background-color: transparent;
+        font-weight: 500;
+    }
+    QFrame#BotBubble QTextBrowser {
+        background-color: transparent;
+        border: none;
+        color: #2d3748;
+        font-size: 11px;
+    }
+"""
+
 class MainWindow(QMainWindow):
     """メインウィンドウ"""
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("OpenRouter Chat Assistant")
@@ -835,32 +1440,66 @@ class MainWindow(QMainWindow):
         
         # 変数初期化
         self.messages = []
-        self.api_thread = None
         self.config = self.load_config()
         self.current_ai_bubble = None  # 現在ストリーミング中のAIメッセージバブル
-        self.model_info_manager = ModelInfoManager(self.config.get('api_key'))
+        self._model_info_manager = None  # 初回使用時に作成
+        # API呼び出しはワーカーがリクエストごとにスレッドプールで処理（シグナルの接続は起動時の1回だけ）
+        self._request_id = 0
+        self._active_request_id = None  # 応答待ちのリクエストID
+        self.api_worker = OpenRouterAPIWorker()
+        # スレッドプールから通知されるシグナルは明示的にキュー接続とする
+        queued = Qt.ConnectionType.QueuedConnection
+        self.api_worker.message_received.connect(self.on_message_received, queued)
+        self.api_worker.message_chunk_received.connect(self.on_message_chunk_received, queued)
+        self.api_worker.error_occurred.connect(self.on_error_occurred, queued)
+        # 最下部へのスクロールをまとめて1回にするためのタイマー
+        self._scroll_timer = QTimer(self)
+        self._scroll_timer.setSingleShot(True)
+        self._scroll_timer.timeout.connect(self._scroll_to_bottom)
+        self._follow_bottom = True  # チャットエリアの最下部を表示中か
+        # 選択モデルの保存を遅延させ、連続した切り替えの書き込みを1回にまとめるタイマー
+        self._save_timer = QTimer(self)
+        self._save_timer.setSingleShot(True)
+        self._save_timer.setInterval(500)
+        self._save_timer.timeout.connect(self._flush_last_selected_model)
         
         self.setup_ui()
         self.setup_styles()
         
-        # UI セットアップ完了後に初期モデル情報を表示
+        # モデルリストの作成と初期モデル情報の表示はウィンドウの表示後（イベントループ開始後）に行う
+        QTimer.singleShot(0, self._populate_model_list)
+        
+    def _populate_model_list(self):
+        """起動時にモデルリストを作成し、選択されているモデルの情報を表示"""
+        self.setup_model_list()
+        # 初回の選択では保存しないよう、作成後にモデル変更時の自動保存を接続
+        self.model_combo.currentTextChanged.connect(self.on_model_changed)
+        
         current_model = self.get_selected_model()
         if current_model:
             self.update_model_info_display(current_model)
+            
+    @property
+    def model_info_manager(self) -> ModelInfoManager:
+        """モデル情報管理（初回アクセス時に作成）"""
+        if self._model_info_manager is None:
+            self._model_info_manager = ModelInfoManager(self.config.get('api_key'))
+            self._model_info_manager.info_ready.connect(self.on_model_info_ready)
+        return self._model_info_manager
         
     def load_config(self) -> Dict:
         """設定を読み込み"""
         try:
             # keyringからAPIキーを取得
-            api_key = keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME) or ''
+            api_key = _get_api_key()
             
-            # その他の設定をJSONファイルから取得
-            try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    config['api_key'] = api_key  # keyringから取得したAPIキーを追加
-                    return config
-            except FileNotFoundError:
+            # その他の設定を取得（ファイルの読み込みは初回のみ）
+            config = _read_config()
+            if config:
+                config = dict(config)
+                config['api_key'] = api_key  # keyringから取得したAPIキーを追加
+                return config
+            else:
                 return {
                     'api_key': api_key, 
                     'base_url': 'https://openrouter.ai/api/v1', 
@@ -876,26 +1515,21 @@ class MainWindow(QMainWindow):
                 'last_selected_model': None
             }
     
+    def _persist_config(self):
+        """メモリ上の設定をファイルに保存（APIキーを除く）"""
+        _write_config({k: v for k, v in self.config.items() if k != 'api_key'})
+    
     def save_custom_model(self, model_data: Dict):
         """カスタムモデルを保存"""
         try:
-            # 設定を読み込み
-            config = self.load_config()
-            if 'custom_models' not in config:
-                config['custom_models'] = []
-            
             # 同じIDのモデルがあるかチェック
-            existing_model = next((m for m in config['custom_models'] if m['id'] == model_data['id']), None)
-            if existing_model:
+            if model_data['id'] in self._custom_model_ids:
                 return False  # 既に存在する
             
-            # 新しいモデルを追加
-            config['custom_models'].append(model_data)
-            
-            # APIキーを除いて保存
-            save_config = {k: v for k, v in config.items() if k != 'api_key'}
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(save_config, f, ensure_ascii=False, indent=2)
+            # 新しいモデルを追加（キャッシュ中のリストは変更しない）
+            self.config['custom_models'] = self.config.get('custom_models', []) + [model_data]
+            self._persist_config()
+            self._custom_model_ids.add(model_data['id'])
             
             return True
         except Exception as e:
@@ -905,119 +1539,79 @@ class MainWindow(QMainWindow):
     def remove_custom_model(self, model_id: str):
         """カスタムモデルを削除"""
         try:
-            config = self.load_config()
-            if 'custom_models' not in config:
+            if model_id not in self._custom_model_ids:
                 return False
             
-            original_count = len(config['custom_models'])
-            config['custom_models'] = [m for m in config['custom_models'] if m['id'] != model_id]
-            
-            if len(config['custom_models']) < original_count:
-                # APIキーを除いて保存
-                save_config = {k: v for k, v in config.items() if k != 'api_key'}
-                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(save_config, f, ensure_ascii=False, indent=2)
-                return True
-            return False
+            self.config['custom_models'] = [m for m in self.config.get('custom_models', []) if m['id'] != model_id]
+            self._persist_config()
+            self._custom_model_ids.discard(model_id)
+            return True
         except Exception as e:
             print(f"カスタムモデル削除エラー: {e}")
             return False
     
     def save_last_selected_model(self, model_id: str):
-        """最後に選択したモデルを保存"""
+        """最後に選択したモデルを保存（連続した変更は一定時間後にまとめて書き込む）"""
+        self.config['last_selected_model'] = model_id
+        self._save_timer.start()
+        
+    def _flush_last_selected_model(self):
+        """最後に選択したモデルをファイルに書き込む"""
+        self._save_timer.stop()
         try:
-            config = self.load_config()
-            config['last_selected_model'] = model_id
-            
-            # APIキーを除いて保存
-            save_config = {k: v for k, v in config.items() if k != 'api_key'}
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(save_config, f, ensure_ascii=False, indent=2)
+            self._persist_config()
         except Exception as e:
             print(f"最後に選択したモデル保存エラー: {e}")
             
     def setup_model_list(self):
         """モデルリストを設定"""
-        self.model_combo.clear()
-        
-        models = {
-            "🔥 おすすめ (Vision対応)": [
-                ("openai/gpt-4o", "GPT-4o - 最新、画像・文書解析"),
-                ("anthropic/claude-3.5-sonnet", "Claude 3.5 Sonnet - 高性能、推論力"),
-                ("google/gemini-pro-1.5", "Gemini Pro 1.5 - 大容量コンテキスト")
-            ],
-            "💰 コスパ重視": [
-                ("openai/gpt-4o-mini", "GPT-4o Mini - 高品質、低価格"),
-                ("anthropic/claude-3-haiku", "Claude 3 Haiku - 高速、軽量"),
-                ("google/gemini-flash-1.5", "Gemini Flash 1.5 - 高速処理")
-            ],
-            "🆓 無料モデル": [
-                ("qwen/qwen-2-vl-72b-instruct", "Qwen2-VL 72B - 無料画像解析"),
-                ("microsoft/phi-3.5-vision-instruct", "Phi-3.5 Vision - 小型高性能"),
-                ("meta-llama/llama-3.1-8b-instruct", "Llama 3.1 8B - 軽量無料")
-            ],
-            "🎨 画像特化": [
-                ("openai/gpt-4-vision-preview", "GPT-4 Vision - 画像理解"),
-                ("mistralai/pixtral-12b", "Pixtral 12B - 画像生成"),
-                ("meta-llama/llama-3.2-90b-vision-instruct", "Llama 3.2 Vision - 大型視覚")
-            ],
-            "💻 コーディング": [
-                ("deepseek/deepseek-v3", "DeepSeek V3 - コーディング特化"),
-                ("mistralai/mistral-large", "Mistral Large - 高性能"),
-                ("cohere/command-r-plus", "Command R+ - 推論力")
-            ],
-            "☁️ Amazon": [
-                ("amazon/nova-pro-v1", "Nova Pro - バランス型"),
-                ("amazon/nova-lite-v1", "Nova Lite - 軽量版")
-            ]
-        }
+        # 項目追加ごとのシグナル発火を抑止し、最後に1回だけ通知する
+        previous_model = self.model_combo.currentData()
+        # 項目はリストにまとめてから一括で追加する
+        items = []
+        # モデルID → 行番号（同じIDがある場合は先に追加した行を優先）
+        model_rows = {}
         
         # カスタムモデルがあればそれを最初に追加
         custom_models = self.config.get('custom_models', [])
+        self._custom_model_ids = {model['id'] for model in custom_models}  # 重複チェック用
         if custom_models:
-            self.model_combo.addItem("────── 🔧 カスタムモデル ──────")
-            separator_index = self.model_combo.count() - 1
-            self.model_combo.model().item(separator_index).setEnabled(False)
-            
+            items.append(self._create_separator_item("🔧 カスタムモデル"))
             for model in custom_models:
-                display_name = f"  {model['name']}"
-                self.model_combo.addItem(display_name, f"custom:{model['id']}")
-        
-        for category, model_list in models.items():
-            self.model_combo.addItem(f"────── {category} ──────")
-            # セパレータアイテムは選択不可に
-            separator_index = self.model_combo.count() - 1
-            self.model_combo.model().item(separator_index).setEnabled(False)
-            
+                model_rows.setdefault(model['id'], len(items))
+                items.append(self._create_model_item(f"  {model['name']}", f"custom:{model['id']}"))
+        
+        for category, model_list in MODEL_CATALOG.items():
+            items.append(self._create_separator_item(category))
             for model_id, description in model_list:
-                self.model_combo.addItem(f"  {description}", model_id)
-        
-        # 最後に選択したモデルを復元、なければデフォルト選択
-        last_selected_model = self.config.get('last_selected_model')
-        if last_selected_model:
-            # モデルIDに対応する表示テキストを検索
-            for i in range(self.model_combo.count()):
-                item_data = self.model_combo.itemData(i)
-                if item_data:
-                    # カスタムモデルの場合
-                    if item_data.startswith("custom:") and item_data[7:] == last_selected_model:
-                        self.model_combo.setCurrentIndex(i)
-                        break
-                    # 通常のモデルの場合
-                    elif item_data == last_selected_model:
-                        self.model_combo.setCurrentIndex(i)
-                        break
-            else:
-                # 見つからない場合はデフォルト選択
-                self.model_combo.setCurrentText("  GPT-4o - 最新、画像・文書解析")
-        else:
-            # 設定がない場合はデフォルト選択
-            self.model_combo.setCurrentText("  GPT-4o - 最新、画像・文書解析")
+                model_rows.setdefault(model_id, len(items))
+                items.append(self._create_model_item(f"  {description}", model_id))
         
-        # 初期モデル情報を表示（UIがセットアップされた後）
-        current_model = self.get_selected_model()
-        if current_model and hasattr(self, 'model_info_label'):
-            self.update_model_info_display(current_model)
+        with QSignalBlocker(self.model_combo):
+            self.model_combo.clear()
+            self.model_combo.model().invisibleRootItem().appendRows(items)
+            
+            # 最後に選択したモデルを復元、なければデフォルト選択
+            row = model_rows.get(self.config.get('last_selected_model'))
+            if row is None:
+                row = model_rows.get(DEFAULT_MODEL, -1)
+            self.model_combo.setCurrentIndex(row)
+        
+        # 選択が変わった場合のみ1回だけ通知（モデル情報の表示もここで更新される）
+        if self.model_combo.currentData() != previous_model:
+            self.model_combo.currentTextChanged.emit(self.model_combo.currentText())
+        
+    def _create_separator_item(self, category: str) -> QStandardItem:
+        """カテゴリ見出し（選択不可）のアイテムを作成"""
+        item = QStandardItem(f"────── {category} ──────")
+        item.setEnabled(False)
+        return item
+        
+    def _create_model_item(self, text: str, model_id: str) -> QStandardItem:
+        """モデル選択肢のアイテムを作成"""
+        item = QStandardItem(text)
+        item.setData(model_id, Qt.ItemDataRole.UserRole)
+        return item
         
     def get_selected_model(self) -> str:
         """選択されたモデルIDを取得"""
@@ -1028,7 +1622,7 @@ class MainWindow(QMainWindow):
                 return current_data[7:]  # "custom:"を除去
             return current_data
         # フォールバック
-        return "openai/gpt-4o"
+        return DEFAULT_MODEL
     def setup_ui(self):
         """UI設定"""
         central_widget = QWidget()
@@ -1043,13 +1637,12 @@ class MainWindow(QMainWindow):
         
         # モデル選択（カテゴリ付き）
         self.model_combo = QComboBox()
-        self.setup_model_list()
+        # 項目は表示後に_populate_model_listで追加する
+        self.model_combo.addItem("読み込み中...")
         self.model_combo.setMinimumWidth(250)
         # カスタムモデルの削除用コンテキストメニュー
         self.model_combo.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.model_combo.customContextMenuRequested.connect(self.show_model_context_menu)
-        # モデル変更時の自動保存
-        self.model_combo.currentTextChanged.connect(self.on_model_changed)
         
         # モデル追加ボタン
         add_model_btn = QPushButton("➕ モデル追加")
@@ -1095,12 +1688,10 @@ class MainWindow(QMainWindow):
         self.chat_scroll = QScrollArea()
         self.chat_scroll.setWidgetResizable(True)
         self.chat_scroll.setMinimumHeight(400)
-        
-        self.chat_widget = QWidget()
-        self.chat_layout = QVBoxLayout()
-        self.chat_layout.addStretch()
-        self.chat_widget.setLayout(self.chat_layout)
-        self.chat_scroll.setWidget(self.chat_widget)
+        scroll_bar = self.chat_scroll.verticalScrollBar()
+        scroll_bar.valueChanged.connect(self._on_chat_scrolled)
+        scroll_bar.rangeChanged.connect(self._on_chat_range_changed)
+        self._create_chat_widget()
         
         splitter.addWidget(self.chat_scroll)
         
@@ -1166,162 +1757,7 @@ class MainWindow(QMainWindow):
         
     def setup_styles(self):
         """スタイル設定"""
-        self.setStyleSheet("""
-            QMainWindow {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #f8f9ff, stop: 1 #e6f3ff);
-            }
-            QTextEdit {
-                border: 2px solid #d1d9ff;
-                border-radius: 12px;
-                padding: 12px;
-                font-size: 13px;
-                background-color: #ffffff;
-                color: #2d3748;
-            }
-            QTextEdit:focus {
-                border-color: #667eea;
-            }
-            QPushButton {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #667eea, stop: 1 #764ba2);
-                color: white;
-                border: none;
-                border-radius: 10px;
-                padding: 12px 24px;
-                font-weight: 600;
-                font-size: 13px;
-                min-height: 20px;
-            }
-            QPushButton:hover {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #5a67d8, stop: 1 #6b46c1);
-            }
-            QPushButton:pressed {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #553c9a, stop: 1 #5b21b6);
-            }
-            QPushButton[objectName="stop_btn"] {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #e53e3e, stop: 1 #c53030);
-            }
-            QPushButton[objectName="stop_btn"]:hover {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #fc8181, stop: 1 #e53e3e);
-            }
-            QPushButton[objectName="stop_btn"]:pressed {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #c53030, stop: 1 #9c2a2a);
-            }
-            QComboBox {
-                border: 2px solid #d1d9ff;
-                border-radius: 10px;
-                padding: 8px 12px;
-                background-color: #ffffff;
-                color: #2d3748;
-                font-size: 13px;
-                font-weight: 500;
-                min-height: 20px;
-            }
-            QComboBox:hover {
-                border-color: #667eea;
-                background-color: #f7fafc;
-            }
-            QComboBox:focus {
-                border-color: #667eea;
-            }
-            QComboBox::drop-down {
-                border: none;
-                border-top-right-radius: 10px;
-                border-bottom-right-radius: 10px;
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #667eea, stop: 1 #764ba2);
-                width: 30px;
-            }
-            QComboBox::down-arrow {
-                image: none;
-                border: 4px solid transparent;
-                border-top: 6px solid white;
-                margin: 0 8px;
-            }
-            QComboBox QAbstractItemView {
-                border: 2px solid #d1d9ff;
-                border-radius: 10px;
-                background-color: #ffffff;
-                selection-background-color: #667eea;
-                selection-color: white;
-                color: #2d3748;
-                font-size: 13px;
-                padding: 4px;
-                outline: none;
-            }
-            QComboBox QAbstractItemView::item {
-                border: none;
-                padding: 8px 12px;
-                margin: 2px;
-                border-radius: 6px;
-                min-height: 20px;
-            }
-            QComboBox QAbstractItemView::item:hover {
-                background-color: #e6f3ff;
-                color: #2d3748;
-            }
-            QComboBox QAbstractItemView::item:selected {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #667eea, stop: 1 #764ba2);
-                color: white;
-                font-weight: 600;
-            }
-            QComboBox QAbstractItemView::item:disabled {
-                color: #a0aec0;
-                background-color: transparent;
-                font-style: italic;
-            }
-            QScrollArea {
-                border: 2px solid #d1d9ff;
-                border-radius: 12px;
-                background-color: #ffffff;
-            }
-            QListWidget {
-                border: 2px solid #d1d9ff;
-                border-radius: 10px;
-                background-color: #f7fafc;
-                alternate-background-color: #ffffff;
-                color: #2d3748;
-                font-size: 12px;
-            }
-            QListWidget::item {
-                padding: 8px;
-                border-radius: 6px;
-                margin: 2px;
-            }
-            QListWidget::item:hover {
-                background-color: #e6f3ff;
-            }
-            QListWidget::item:selected {
-                background: qlineargradient(x1: 0, y1: 0, x2: 0, y2: 1,
-                    stop: 0 #667eea, stop: 1 #764ba2);
-                color: white;
-            }
-            QLabel {
-                color: #2d3748;
-                font-weight: 500;
-            }
-            QProgressBar {
-                border: 2px solid #d1d9ff;
-                border-radius: 8px;
-                background-color: #f7fafc;
-                text-align: center;
-                font-weight: 600;
-                color: #2d3748;
-            }
-            QProgressBar::chunk {
-                background: qlineargradient(x1: 0, y1: 0, x2: 1, y2: 0,
-                    stop: 0 #667eea, stop: 1 #764ba2);
-                border-radius: 6px;
-                margin: 2px;
-            }
-        """)
+        self.setStyleSheet(MAIN_STYLESHEET)
         
     def eventFilter(self, obj, event):
         """イベントフィルター"""
@@ -1353,8 +1789,8 @@ class MainWindow(QMainWindow):
         if dialog.exec() == QDialog.DialogCode.Accepted:
             dialog.save_config()
             self.config = self.load_config()
-            # ModelInfoManagerを更新
-            self.model_info_manager = ModelInfoManager(self.config.get('api_key'))
+            # ModelInfoManagerは新しいAPIキーで次回使用時に作り直す
+            self._model_info_manager = None
             QMessageBox.information(self, "設定", "設定が保存されました。")
             
     def add_file_dialog(self):
@@ -1378,12 +1814,28 @@ class MainWindow(QMainWindow):
     def add_chat_bubble(self, message: str, is_user: bool = False, images: List[str] = None):
         """チャット吹き出しを追加"""
         bubble = ChatBubble(message, is_user, images)
-        self.chat_layout.insertWidget(self.chat_layout.count() - 1, bubble)
+        self.chat_layout.addWidget(bubble)
+        
+        self._schedule_scroll_to_bottom()
+        
+    def _schedule_scroll_to_bottom(self):
+        """最下部へのスクロールを予約（16ms以内の要求はまとめて1回にする）"""
+        if not self._scroll_timer.isActive():
+            self._scroll_timer.start(16)
+        
+    def _scroll_to_bottom(self):
+        """チャットエリアを最下部までスクロール"""
+        scroll_bar = self.chat_scroll.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+        
+    def _on_chat_scrolled(self, value: int):
+        """スクロール位置の変更時に、最下部を表示中かどうかを記録"""
+        self._follow_bottom = value >= self.chat_scroll.verticalScrollBar().maximum() - 4
         
-        # スクロールを最下部に
-        QTimer.singleShot(100, lambda: self.chat_scroll.verticalScrollBar().setValue(
-            self.chat_scroll.verticalScrollBar().maximum()
-        ))
+    def _on_chat_range_changed(self, minimum: int, maximum: int):
+        """内容の高さが変わったとき、最下部を表示中なら追従（上に戻って読んでいる場合は動かさない）"""
+        if self._follow_bottom:
+            self.chat_scroll.verticalScrollBar().setValue(maximum)
         
     def send_message(self):
         """メッセージ送信"""
@@ -1425,61 +1877,73 @@ class MainWindow(QMainWindow):
         
         # ストリーミング用のAIメッセージバブルを先に作成
         self.current_ai_bubble = ChatBubble("", False)
-        self.chat_layout.insertWidget(self.chat_layout.count() - 1, self.current_ai_bubble)
+        self.chat_layout.addWidget(self.current_ai_bubble)
         
         # API呼び出し（コピーしたファイルを使用）
-        self.api_thread = OpenRouterAPIThread(
-            self.config['api_key'],
-            self.config['base_url'],
-            self.get_selected_model(),  # 正しいモデルIDを取得
-            self.messages,
-            current_files
-        )
-        self.api_thread.message_received.connect(self.on_message_received)
-        self.api_thread.message_chunk_received.connect(self.on_message_chunk_received)
-        self.api_thread.error_occurred.connect(self.on_error_occurred)
-        self.api_thread.start()
+        self._request_id += 1
+        self._active_request_id = self._request_id
+        self.api_worker.process_request({
+            'request_id': self._request_id,
+            'api_key': self.config['api_key'],
+            'base_url': self.config['base_url'],
+            'model': self.get_selected_model(),  # 正しいモデルIDを取得
+            'messages': self.messages[-MAX_HISTORY_MESSAGES:],  # 直近の履歴のみ送信
+            'attached_files': current_files,
+            'upload_url': self.config.get('upload_url', '')
+        })
         
-    def on_message_chunk_received(self, chunk: str):
+    def on_message_chunk_received(self, request_id: int, chunk: str):
         """ストリーミングチャンク受信時の処理"""
+        if request_id != self._active_request_id:
+            return  # 停止済みリクエストの応答は無視
         if self.current_ai_bubble:
+            # 最下部を表示中なら、内容が伸びたときに_on_chat_range_changedで追従する
             self.current_ai_bubble.update_message(chunk)
-            # スクロールを最下部に
-            QTimer.singleShot(10, lambda: self.chat_scroll.verticalScrollBar().setValue(
-                self.chat_scroll.verticalScrollBar().maximum()
-            ))
     
-    def on_message_received(self, message: str):
+    def on_message_received(self, request_id: int, message: str):
         """メッセージ受信完了時の処理"""
+        if request_id != self._active_request_id:
+            return
+        self._active_request_id = None
         self.messages.append({
             'role': 'assistant',
             'content': message
         })
         
+        if self.current_ai_bubble:
+            self.current_ai_bubble.finish_message()
         self.current_ai_bubble = None  # ストリーミング完了
-        self.stop_btn.hide()
-        self.send_btn.show()
-        self.progress_bar.hide()
+        self._reset_input_ui()
         
-    def on_error_occurred(self, error: str):
+    def on_error_occurred(self, request_id: int, error: str):
         """エラー発生時の処理"""
+        if request_id != self._active_request_id:
+            return
+        self._active_request_id = None
         # エラー時は作成したAIバブルを削除
         if self.current_ai_bubble:
             self.current_ai_bubble.deleteLater()
             self.current_ai_bubble = None
         
         QMessageBox.critical(self, "エラー", error)
-        self.stop_btn.hide()
-        self.send_btn.show()
-        self.progress_bar.hide()
+        self._reset_input_ui()
+        
+    def _create_chat_widget(self):
+        """吹き出しを並べるウィジェットを作成してスクロールエリアに設定"""
+        self.chat_widget = QWidget()
+        self.chat_layout = QVBoxLayout()
+        # 末尾のストレッチの代わりに上詰め配置にし、吹き出しは末尾に追加するだけにする
+        self.chat_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
+        self.chat_widget.setLayout(self.chat_layout)
+        # 以前のウィジェットは吹き出しごとQScrollAreaが破棄する
+        self.chat_scroll.setWidget(self.chat_widget)
         
     def clear_chat(self):
         """チャットをクリア"""
-        # チャット履歴をクリア
-        for i in reversed(range(self.chat_layout.count() - 1)):
-            child = self.chat_layout.itemAt(i).widget()
-            if child:
-                child.deleteLater()
+        # 応答中の吹き出しも破棄されるため、先に推論を停止する
+        self.stop_inference()
+        # 吹き出しを1つずつ削除せず、空のウィジェットに差し替えてまとめて破棄する
+        self._create_chat_widget()
                 
         self.messages.clear()
         QMessageBox.information(self, "クリア", "チャット履歴がクリアされました。")
@@ -1497,8 +1961,6 @@ class MainWindow(QMainWindow):
             
             # モデルを保存
             if self.save_custom_model(model_data):
-                # 設定を再読み込み
-                self.config = self.load_config()
                 # モデルリストを更新
                 current_text = self.model_combo.currentText()
                 self.setup_model_list()
@@ -1533,8 +1995,6 @@ class MainWindow(QMainWindow):
         
         if reply == QMessageBox.StandardButton.Yes:
             if self.remove_custom_model(model_id):
-                # 設定を再読み込み
-                self.config = self.load_config()
                 # モデルリストを更新
                 self.setup_model_list()
                 QMessageBox.information(self, "成功", "カスタムモデルが削除されました。")
@@ -1554,20 +2014,21 @@ class MainWindow(QMainWindow):
         if not hasattr(self, 'model_info_label'):
             return
             
+        self.show_model_info(model_id, self.model_info_manager.get_model_info(model_id))
+        
+    def on_model_info_ready(self, model_id: str, model_info: Dict):
+        """APIからモデル情報を取得できたときの処理"""
+        # 取得中に別のモデルが選択された場合は表示しない
+        if model_id == self.get_selected_model():
+            self.show_model_info(model_id, model_info)
+    
+    def show_model_info(self, model_id: str, model_info: Dict):
+        """モデル情報をラベルに表示"""
         try:
-            model_info = self.model_info_manager.get_model_info(model_id)
             input_types = model_info.get('input_types', ['text'])
             
-            # 入力タイプのアイコンを作成
-            type_icons = []
-            if 'text' in input_types:
-                type_icons.append('📝')
-            if 'image' in input_types:
-                type_icons.append('🖼️')
-            if 'audio' in input_types:
-                type_icons.append('🎵')
-            if 'video' in input_types:
-                type_icons.append('🎥')
+            # 入力タイプのアイコンを作成（表示順はINPUT_TYPE_ICONSの順）
+            type_icons = [icon for input_type, icon in INPUT_TYPE_ICONS.items() if input_type in input_types]
             
             # 表示テキストを作成
             if len(type_icons) > 1:
@@ -1587,9 +2048,10 @@ class MainWindow(QMainWindow):
     
     def stop_inference(self):
         """推論を停止"""
-        if self.api_thread and self.api_thread.isRunning():
-            self.api_thread.stop()
-            self.api_thread.wait(1000)  # 1秒待機
+        if self._active_request_id is not None:
+            # ワーカーは停止したリクエストの結果を通知しない
+            self.api_worker.cancel(self._active_request_id)
+            self._active_request_id = None
             
             # 現在のAIバブルを削除
             if self.current_ai_bubble:
@@ -1597,13 +2059,32 @@ class MainWindow(QMainWindow):
                 self.current_ai_bubble = None
             
             # UIを元に戻す
-            self.stop_btn.hide()
-            self.send_btn.show()
-            self.progress_bar.hide()
+            self._reset_input_ui()
+    
+    def _reset_input_ui(self):
+        """応答待ちの表示（停止ボタン・プログレスバー）を送信可能な状態に戻す"""
+        self.stop_btn.hide()
+        self.send_btn.show()
+        self.progress_bar.hide()
+    
+    def closeEvent(self, event):
+        """終了時にAPIリクエストを停止
+        
+        受信中のストリームは即座に切断されるが、ヘッダー待ちやアップロード中のリクエストは
+        中断できず、タイムアウト（60秒）まで残る。プールの破棄時にはその終了を待つ。
+        """
+        if self._save_timer.isActive():
+            self._flush_last_selected_model()
+        if self._active_request_id is not None:
+            self.api_worker.cancel(self._active_request_id)
+        # 切断したストリームの後始末だけを短時間待つ（通信待ちのタスクはここでは打ち切れない）
+        self.api_worker.wait_for_done(1000)
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     app.setStyle('Fusion')  # モダンなスタイル
+    QPixmapCache.setCacheLimit(64 * 1024)  # KB単位
     
     window = MainWindow()
     window.show()